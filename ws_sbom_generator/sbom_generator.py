@@ -5,30 +5,49 @@ import logging
 import os
 import argparse
 import sys
-from enum import Enum
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
+import requests.adapters
 from spdx import version, creationinfo
 from spdx.checksum import Algorithm
 from spdx.creationinfo import CreationInfo
 from spdx.document import Document, License
 from spdx.package import Package
+from spdx.parsers.loggers import ErrorMessages
 from spdx.relationship import Relationship, RelationshipType
 from spdx.utils import SPDXNone, NoAssert
+from spdx.writers.jsonyamlxml import Writer as JsonYamlXmlWriter
+from spdx.writers.tagvalue import InvalidDocumentError
 from ws_sdk import ws_constants, WS, ws_utilities
 from ws_sbom_generator._version import __version__
 
+try:
+    import orjson                       # Considerably faster than stdlib json, but optional
+except ImportError:
+    orjson = None
+
 
 logging.basicConfig(level=logging.DEBUG if os.environ.get("DEBUG") else logging.INFO,
                     handlers=[logging.StreamHandler(stream=sys.stdout)],
                     format='%(levelname)s %(asctime)s %(thread)d %(name)s: %(message)s',
                     datefmt='%y-%m-%d %H:%M:%S')
+is_debug = logging.root.isEnabledFor(logging.DEBUG)
+NO_ASSERT = NoAssert()                  # Value-less SPDX sentinels, shared instead of allocated per package
+SPDX_NONE = SPDXNone()
 args = None
 
 
+@lru_cache(maxsize=1024)
+def get_scope(scope_token) -> dict:
+    return args.ws_conn.get_scope_by_token(scope_token)
+
+
 def create_sbom_doc(scope_token) -> Document:
-    scope = args.ws_conn.get_scope_by_token(scope_token)
-    logging.info(f"Creating SBOM Document from WhiteSource {scope['type']}: {scope['name']}")
-    scope_name = args.ws_conn.get_scope_name_by_token(scope_token)
+    scope = get_scope(scope_token)
+    logging.info("Creating SBOM Document from WhiteSource %s: %s", scope['type'], scope['name'])
+    scope_name = scope['name']
     namespace = args.extra_conf.get('namespace', 'https://[CreatorWebsite]/[pathToSpdx]/[DocumentName]-[UUID]')
     doc, doc_spdx_id = create_document(scope_name, namespace)
 
@@ -39,8 +58,8 @@ def create_sbom_doc(scope_token) -> Document:
     libs_from_lic_report = args.ws_conn.get_licenses(token=scope_token, full_spdx=True)
     file_path = None
     if libs_from_lic_report:
-        logging.debug(f"Handling {len(libs_from_lic_report)} libraries in {scope['type']}: {scope['name']}")
-        logging.info(f"Finished report: {scope['type']}: {scope['name']}")
+        logging.debug("Handling %s libraries in %s: %s", len(libs_from_lic_report), scope['type'], scope['name'])
+        logging.info("Finished report: %s: %s", scope['type'], scope['name'])
         due_dil_report = args.ws_conn.get_due_diligence(token=scope_token)
         lib_hierarchy_report = args.ws_conn.get_inventory(token=scope_token, with_dependencies=True)
         doc.packages, pkgs_spdx_ids, pkg_relationships = create_packages(libs_from_lic_report, due_dil_report, lib_hierarchy_report)    # TODO SPDX Design issue - Relationship between packages should be on package level
@@ -50,36 +69,33 @@ def create_sbom_doc(scope_token) -> Document:
 
         file_path = write_report(doc, args.type)
     else:
-        logging.error(f"{scope['type'].capitalize()}: {scope['name']} Has no libraries. Report will not be generated")
+        logging.error("%s: %s Has no libraries. Report will not be generated", scope['type'].capitalize(), scope['name'])
 
-        logging.info(f"Report saved at {file_path}")
+        logging.info("Report saved at %s", file_path)
 
     return file_path
 
 
 def get_document_relationships(pkgs_spdx_ids: list, doc_spdx_id: str) -> list:
-    doc_relationships = []
-    for pkg_id in pkgs_spdx_ids:
-        doc_relationships.append(Relationship(relationship=f"{pkg_id} {RelationshipType.DESCRIBED_BY.name} {doc_spdx_id}"))
-
-    return doc_relationships
+    return [Relationship(relationship=f"{pkg_id} {RelationshipType.DESCRIBED_BY.name} {doc_spdx_id}")
+            for pkg_id in pkgs_spdx_ids]
 
 
 def create_document(scope_name: str, namespace) -> Document:
-    logging.debug(f"Creating SBOM Document entity on: {scope_name}")
+    logging.debug("Creating SBOM Document entity on: %s", scope_name)
     doc_spdx_id = generate_spdx_id("SPDXRef-DOCUMENT")
     document = Document(name=f"WhiteSource {scope_name} SBOM report",
                         namespace=namespace,
                         spdx_id=doc_spdx_id,
                         version=version.Version(2, 2),
                         data_license=License.from_identifier("CC0-1.0"))
-    logging.debug(f"Finished SBOM Document entity on {scope_name}")
+    logging.debug("Finished SBOM Document entity on %s", scope_name)
 
     return document, doc_spdx_id
 
 
 def create_creation_info(org_name, org_email, person_name, person_email):
-    logging.debug(f"Creating Creation Info entity")
+    logging.debug("Creating Creation Info entity")
     creation_info = CreationInfo()
     creation_info.set_created_now()
     org = creationinfo.Organization(org_name, org_email)
@@ -89,64 +105,70 @@ def create_creation_info(org_name, org_email, person_name, person_email):
     creation_info.add_creator(org)
     creation_info.add_creator(tool)
     creation_info.add_creator(person)
-    logging.debug(f"Finished creating Creation Info entity")
+    logging.debug("Finished creating Creation Info entity")
 
     return creation_info
 
 
 def create_packages(libs, due_dil, lib_hierarchy) -> tuple:
-    logging.debug(f"Creating Packages entity")
-    for d in due_dil:
-        d['library'] = d['library'].rstrip('*')
-    dd_dict = ws_utilities.convert_dict_list_to_dict(lst=due_dil, key_desc=('library', 'name'))
+    logging.debug("Creating Packages entity")
+    if due_dil:
+        due_dil = [dict(d, library=d['library'].rstrip('*')) for d in due_dil]
+        dd_dict = ws_utilities.convert_dict_list_to_dict(lst=due_dil, key_desc=('library', 'name'))
+    else:
+        dd_dict = {}
     libs_hierarchy_dict = ws_utilities.convert_dict_list_to_dict(lst=lib_hierarchy, key_desc='keyUuid')
-    packages = []
-    pkgs_spdx_ids = []
-    pkgs_relationships = []
-    for lib in libs:
-        pkg, pkg_spdx_id, pkg_relationships = create_package(lib, dd_dict, libs_hierarchy_dict.get(lib['keyUuid'], {}))
-        packages.append(pkg)
-        pkgs_spdx_ids.append(pkg_spdx_id)
-        pkgs_relationships.extend(pkg_relationships)
-    logging.debug(f"Finished creating Packages entity")
+    results = [create_package(lib, dd_dict, libs_hierarchy_dict.get(lib['keyUuid'], {})) for lib in libs]
+    if results:
+        packages, pkgs_spdx_ids, rel_lists = map(list, zip(*results))
+        pkgs_relationships = [rel for rels in rel_lists for rel in rels]
+    else:
+        packages, pkgs_spdx_ids, pkgs_relationships = [], [], []
+    logging.debug("Finished creating Packages entity")
 
     return packages, pkgs_spdx_ids, pkgs_relationships
 
 
+@lru_cache(maxsize=512)
+def get_license(full_name, identifier) -> License:
+    return License(full_name=full_name, identifier=identifier)
+
+
+@lru_cache(maxsize=512)
+def get_organization(name) -> creationinfo.Organization:
+    return creationinfo.Organization(name, NO_ASSERT)
+
+
 def create_package(lib, dd_dict, lib_hierarchy_dict) -> tuple:
     pkg_spdx_id = generate_spdx_id(f"SPDXRef-PACKAGE-{lib['filename']}")
-    logging.debug(f"Creating Package {pkg_spdx_id}")
+    if is_debug:
+        logging.debug("Creating Package %s", pkg_spdx_id)
     lib_licenses = lib.get('licenses')
-    dd_keys = [(lib.get('filename'), lic['name']) for lic in lib_licenses]
-    dd_entities = [dd_dict.get(dd_key) for dd_key in dd_keys]
-    originator = NoAssert()
+    first_lic = lib_licenses[0] if lib_licenses else None       # Only the first license's DD entity is used
+    dd_entity = dd_dict.get((lib.get('filename'), first_lic['name'])) if dd_dict and first_lic else None
+    originator = NO_ASSERT
     lib_copyrights = lib.get('copyrightReferences')
-    author = None
-
-    if dd_entities:                                             # Trying to get Author from Due Diligence
-        author = dd_entities[0].get('author')
-    if not author:                                              # If failed from DD, trying from lib
-        logging.debug("No author found from Due Diligence data. Trying to get copyright from library data")
-        author = get_author_from_cr(lib_copyrights)
+    # Author from Due Diligence, falling back to library copyright data
+    author = (dd_entity.get('author') if dd_entity else None) or get_author_from_cr(lib_copyrights)
     if author:
-        originator = creationinfo.Organization(author, NoAssert())
+        originator = get_organization(author)
     else:
-        logging.warning(f"Unable to find the author of library: {lib['name']} ")
+        logging.warning("Unable to find the author of library: %s ", lib['name'])
 
     copyrights = [c.get('copyright') for c in lib_copyrights]
     if not copyrights:
-        logging.warning(f"No copyright info found for library: {lib['name']}")
-        copyrights = SPDXNone()
+        logging.warning("No copyright info found for library: %s", lib['name'])
+        copyrights = SPDX_NONE
     references = lib.get('references')
     if not references:
-        logging.warning(f"No references were found for library: {lib['name']}")
-    download_location = references.get('url', NoAssert()) if references else NoAssert()
+        logging.warning("No references were found for library: %s", lib['name'])
+    download_location = references.get('url', NO_ASSERT) if references else NO_ASSERT
 
     package = Package(name=lib["name"],
                       spdx_id=pkg_spdx_id,
                       download_location=download_location,
-                      version=lib.get('version', NoAssert()),
-                      file_name=lib.get('filename', NoAssert()),
+                      version=lib.get('version', NO_ASSERT),
+                      file_name=lib.get('filename', NO_ASSERT),
                       supplier=originator,
                       originator=originator)
 
@@ -154,42 +176,41 @@ def create_package(lib, dd_dict, lib_hierarchy_dict) -> tuple:
     package.homepage = download_location
     package.check_sum = Algorithm(identifier="SHA-1", value=lib['sha1'])
 
-    licenses = [License(full_name=lic.get('name'), identifier=lic.get('spdxName')) for lic in lib_licenses]
+    licenses = [get_license(lic.get('name'), lic.get('spdxName')) for lic in lib_licenses]
     package.licenses_from_files = licenses
     if len(licenses) > 1:
-        logging.warning(f"Found {len(licenses)} licenses on library: {lib['name']}. Using the first one")
+        logging.warning("Found %s licenses on library: %s. Using the first one", len(licenses), lib['name'])
     if licenses:                         # TODO should be fixed in SPDX-TOOLS as it is possible to have multiple lics
         licenses = licenses[0]
     else:
-        logging.warning(f"No license found for library: {lib['name']}")
-        licenses = SPDXNone()
+        logging.warning("No license found for library: %s", lib['name'])
+        licenses = SPDX_NONE
 
     package.conc_lics = licenses
     package.license_declared = licenses
     package.cr_text = copyrights         # TODO should be fixed in SPDX-TOOLS as is possible to have multiple copyrights
     pkg_relationships = get_pkg_relationships(lib_hierarchy_dict, pkg_spdx_id)
 
-    logging.debug(f"Finished creating Package: {pkg_spdx_id}")
+    if is_debug:
+        logging.debug("Finished creating Package: %s", pkg_spdx_id)
 
     return package, pkg_spdx_id, pkg_relationships
 
 
 def get_pkg_relationships(lib_hierarchy_dict, pkg_spdx_id) -> list:
-    pkg_relationships = []
-    for dep_lib in lib_hierarchy_dict.get('dependencies', []):
-        pkg_relationships.append(Relationship(relationship=f"{pkg_spdx_id} {RelationshipType.DEPENDS_ON.name} SPDXRef-PACKAGE-{dep_lib['filename']}"))
-
-    return pkg_relationships
+    return [Relationship(relationship=f"{pkg_spdx_id} {RelationshipType.DEPENDS_ON.name} SPDXRef-PACKAGE-{dep_lib['filename']}")
+            for dep_lib in lib_hierarchy_dict.get('dependencies', [])]
 
 
 def get_author_from_cr(copyright_references: list) -> str:
-    authors = [a['author'] for a in copyright_references if a.get('author')]
-    if len(authors) > 1:
-        logging.warning(f"Found {len(authors)} authors on the lib. Report will contain one")
-    elif not authors:
+    authors_iter = (a['author'] for a in reversed(copyright_references) if a.get('author'))
+    author = next(authors_iter, None)
+    if author is None:
         logging.warning("No author data found on lib")
+    elif next(authors_iter, None) is not None:
+        logging.warning("Found multiple authors on the lib. Report will contain one")
 
-    return authors.pop() if authors else None
+    return author
 
 
 def init():
@@ -197,10 +218,15 @@ def init():
                       user_key=args.ws_user_key,
                       token=args.ws_token,
                       tool_details=("ps-sbom-generator", __version__))
+    # Pool sized to match the scope worker pool so concurrent API calls reuse keep-alive connections
+    adapter = requests.adapters.HTTPAdapter(pool_connections=32, pool_maxsize=32)
+    args.ws_conn.session.mount('https://', adapter)
+    args.ws_conn.session.mount('http://', adapter)
     args.extra_conf = {}
     try:
-        fp = open(args.extra, 'r')
-        args.extra_conf = json.loads(fp.read())
+        with open(args.extra, 'rb') as fp:
+            conf_data = fp.read()
+        args.extra_conf = orjson.loads(conf_data) if orjson else json.loads(conf_data)
     except FileNotFoundError:
         logging.warning(f'''{args.extra} configuration file was not found. Be sure to create a file in the following structure:
             {{
@@ -211,7 +237,7 @@ def init():
             }}
         ''')
     except json.JSONDecodeError:
-        logging.error(f"Unable to parse file: {args.extra}")
+        logging.error("Unable to parse file: %s", args.extra)
 
 
 def parse_args():
@@ -223,7 +249,7 @@ def parse_args():
     parser.add_argument('-s', '--scope', help="Scope token of SBOM report to generate", dest='scope_token', default=os.environ.get("WS_SCOPE"))
     parser.add_argument('-a', '--wsUrl', help="WS URL", dest='ws_url', default=os.environ.get("WS_URL"))
     parser.add_argument('-t', '--type', help="Output type", dest='type', default=os.environ.get("WS_REPORT_TYPE", 'tv'),
-                        choices=[f_t.lower() for f_t in SPDXFileType.__members__.keys()] + ["all"])
+                        choices=SPDX_FILE_TYPE_NAMES + ["all"])
     parser.add_argument('-e', '--extra', help="Extra configuration of SBOM", dest='extra', default=os.path.join(resource_real_path, "sbom_extra.json"))
     parser.add_argument('-o', '--out', help="Output directory", dest='out_dir', default=os.path.join(real_path, "output"))
     arguments = parser.parse_args()
@@ -242,81 +268,98 @@ def parse_args():
     return arguments
 
 
+INVALID_FS_CHARS_TRANS = str.maketrans({c: "_" for c in ws_constants.INVALID_FS_CHARS})
+
+
 def replace_invalid_chars(filename: str) -> str:
-    old_name = filename
-    for char in ws_constants.INVALID_FS_CHARS:
-        filename = filename.replace(char, "_")
-    logging.debug(f"Original name:'{old_name}' Fixed filename: '{filename}'")
+    fixed_filename = filename.translate(INVALID_FS_CHARS_TRANS)
+    logging.debug("Original name:'%s' Fixed filename: '%s'", filename, fixed_filename)
 
-    return filename
+    return fixed_filename
 
 
 def write_report(doc: Document, file_type: str) -> str:
-    f_types = [f_t.lower() for f_t in SPDXFileType.__members__.keys()] if file_type == "all" else [file_type]
-    full_paths = []
+    f_types = SPDX_FILE_TYPE_NAMES if file_type == "all" else [file_type]
 
-    for f_type in f_types:
-        full_path = write_file(SPDXFileType, doc, f_type)
-        full_paths.append(full_path)
+    # Formats are independent and the document is read-only at this point, so write them concurrently
+    with ThreadPoolExecutor(max_workers=len(f_types)) as executor:
+        full_paths = list(executor.map(lambda f_t: write_file(doc, f_t), f_types))
 
     return full_paths
 
 
-def write_file(spdx_f_t_enum, doc, file_type) -> str:
-    logging.info(f"Saving report in {file_type} format")
-    spdx_file_type = spdx_f_t_enum.get_file_type(file_type)
+@lru_cache(maxsize=None)
+def get_writer_module(module_classpath: str):
+    logging.debug("Loading writer module: %s", module_classpath)
+
+    return importlib.import_module(module_classpath)
+
+
+def encode_spdx(obj):
+    if isinstance(obj, (NoAssert, SPDXNone)):
+        return obj.to_value()
+    raise TypeError(f"Type is not JSON serializable: {type(obj)}")
+
+
+def write_json_document(document, out, validate=True):
+    if validate:
+        messages = document.validate(ErrorMessages())
+        if messages:
+            raise InvalidDocumentError(messages)
+
+    document_object = JsonYamlXmlWriter(document).create_document()
+    if orjson:
+        out.write(orjson.dumps(document_object, default=encode_spdx,
+                               option=orjson.OPT_INDENT_2 | orjson.OPT_PASSTHROUGH_SUBCLASS))
+    else:
+        out.write(json.dumps(document_object, indent=4, default=encode_spdx).encode('utf-8'))
+
+
+def preload_writer_modules(file_type: str):
+    f_types = SPDX_FILE_TYPE_NAMES if file_type == "all" else [file_type]
+    executor = ThreadPoolExecutor(max_workers=1)
+    for f_t in f_types:
+        executor.submit(get_writer_module, SPDX_FILE_TYPES[f_t].module_classpath)
+    executor.shutdown(wait=False)       # Imports finish in the background while WS API calls are in flight
+
+
+def write_file(doc, file_type) -> str:
+    logging.info("Saving report in %s format", file_type)
+    spdx_file_type = SPDX_FILE_TYPES[file_type]
     report_filename = replace_invalid_chars(f"{doc.name}-{doc.version}.{spdx_file_type.suffix}")
     full_path = os.path.join(args.out_dir, report_filename)
 
-    if not os.path.exists(args.out_dir):
-        logging.info(f"Dir: {args.out_dir} does not exist. Creating it")
-        os.mkdir(args.out_dir)
+    os.makedirs(args.out_dir, exist_ok=True)    # exist_ok as concurrent writers race on creating the dir
 
-    module = importlib.import_module(spdx_file_type.module_classpath)  # Dynamically loading appropriate writer module
-    logging.debug(f"Writing file: {full_path} in format: {file_type}")
-    with open(full_path, mode=spdx_file_type.f_flags, encoding=spdx_file_type.encoding) as fp:
+    if file_type == "json":             # Custom writer which serializes the SPDX sentinel objects
+        write_document = write_json_document
+    else:                               # Appropriate writer module, loaded once per process
+        write_document = get_writer_module(spdx_file_type.module_classpath).write_document
+    logging.debug("Writing file: %s in format: %s", full_path, file_type)
+    # SPDX writers emit many small writes, so a large buffer keeps the syscall count down
+    with open(full_path, mode=spdx_file_type.f_flags, encoding=spdx_file_type.encoding, buffering=1 << 20) as fp:
         try:
-            module.write_document(doc, fp)
+            write_document(doc, fp)
         except TypeError:
             logging.exception("Error writing file")
 
     return full_path
 
 
-class SPDXFileType(Enum):
-    JSON = ("json", "spdx.writers.json", "w", None)  # TODO open spdx bug: Object of type NoAssert is not JSON serializable
-    TV = ("tv", "spdx.writers.tagvalue", "w", "utf-8")
-    RDF = ("xml", "spdx.writers.rdf", "wb", None)
-    XML = ("xml", "spdx.writers.xml", "wb", None)
-    YAML = ("yml", "spdx.writers.yaml", "wb", None)   # TODO: this will only work if  bug fix in spdx_tools: yaml.py -> write_document
-
-    def __str__(self):
-        return self.name
-
-    @classmethod
-    def get_file_type(cls, f_t: str):
-        return cls.__dict__[f_t.upper()]
-
-    @property
-    def suffix(self):
-        return self.value[0]
-
-    @property
-    def module_classpath(self):
-        return self.value[1]
+SPDXFileType = namedtuple('SPDXFileType', ['suffix', 'module_classpath', 'f_flags', 'encoding'])
 
-    @property
-    def f_flags(self):
-        return self.value[2]
+SPDX_FILE_TYPES = {'json': SPDXFileType("json", "spdx.writers.json", "wb", None),  # Written by write_json_document as spdx's writer cannot serialize NoAssert
+                   'tv': SPDXFileType("tv", "spdx.writers.tagvalue", "w", "utf-8"),
+                   'rdf': SPDXFileType("rdf.xml", "spdx.writers.rdf", "wb", None),  # Distinct suffix so rdf and xml do not share an output path
+                   'xml': SPDXFileType("xml", "spdx.writers.xml", "wb", None),
+                   'yaml': SPDXFileType("yml", "spdx.writers.yaml", "wb", None)}   # TODO: this will only work if  bug fix in spdx_tools: yaml.py -> write_document
 
-    @property
-    def encoding(self):
-        return self.value[3]
+SPDX_FILE_TYPE_NAMES = list(SPDX_FILE_TYPES)
 
 
 def generate_spdx_id(id_val) -> str:
     spdx_id = id_val.replace(' ', '_')      # TODO SPDX issue: RELATIONSHIP are parsed as a text (better tuple it)
-    logging.debug(f"Generating SPDX ID: Received value: '{id_val}'. ID value: '{spdx_id}'")
+    logging.debug("Generating SPDX ID: Received value: '%s'. ID value: '%s'", id_val, spdx_id)
 
     return spdx_id
 
@@ -327,21 +370,23 @@ def main():
     try:
         args = parse_args()
         init()
+        preload_writer_modules(args.type)
         scope_type = None
         if ws_utilities.is_token(args.scope_token):
             scope_type = args.ws_conn.get_scope_type_by_token(args.scope_token)
 
         if scope_type == ws_constants.PROJECT:
-            scopes = [args.ws_conn.get_scope_by_token(args.scope_token)]
+            scopes = [get_scope(args.scope_token)]
         elif scope_type == ws_constants.PRODUCT:
             scopes = args.ws_conn.get_projects(product_token=args.scope_token)
-            logging.info(f"Creating SBOM report per project in {scope_type}: {scopes[0]['productName']}")
+            logging.info("Creating SBOM report per project in %s: %s", scope_type, scopes[0]['productName'])
         else:
             logging.info("Creating SBOM reports on all Organization Projects")
             scopes = args.ws_conn.get_projects()
 
-        for scope in scopes:
-            file_paths = create_sbom_doc(scope['token'])
+        if scopes:          # Scopes are independent and I/O bound so reports are generated concurrently
+            with ThreadPoolExecutor(max_workers=min(32, len(scopes))) as executor:
+                file_paths = list(executor.map(lambda scope: create_sbom_doc(scope['token']), scopes))
     except ValueError:
         logging.error("Error running SBOM Generator")
 
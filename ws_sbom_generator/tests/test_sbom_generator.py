@@ -1,3 +1,5 @@
+import io
+import json
 from unittest.mock import patch
 
 import pytest
@@ -108,6 +110,45 @@ def test_replace_invalid_chars():
     assert returned == "FILE_NAME"
 
 
+def build_doc_with_sentinels() -> document.Document:
+    doc, _ = sbom_generator.create_document("NAME", "NAMESPACE")
+    doc.creation_info = sbom_generator.create_creation_info("ORG_NAME", "ORG_EMAIL", "PERSON_NAME", "PERSON_EMAIL")
+    lib = {'name': "NAME",
+           'filename': "FILENAME",
+           'sha1': "SHA1",
+           'licenses': [],
+           'copyrightReferences': []}
+    pkg, _, _ = sbom_generator.create_package(lib, {}, {})
+    doc.packages = [pkg]
+
+    return doc
+
+
+def assert_json_document_sentinels(raw: bytes):
+    pkg_object = json.loads(raw)['Document']['documentDescribes'][0]['Package']
+
+    assert pkg_object['downloadLocation'] == "NOASSERTION"
+    assert pkg_object['originator'] == "NOASSERTION"
+    assert pkg_object['copyrightText'] == "NONE"
+    assert pkg_object['licenseConcluded'] == "NONE"
+
+
+@pytest.mark.skipif(sbom_generator.orjson is None, reason="orjson is not installed")
+def test_write_json_document():
+    out = io.BytesIO()
+    sbom_generator.write_json_document(build_doc_with_sentinels(), out, validate=False)
+
+    assert_json_document_sentinels(out.getvalue())
+
+
+@patch('ws_sbom_generator.sbom_generator.orjson', None)
+def test_write_json_document_stdlib_fallback():
+    out = io.BytesIO()
+    sbom_generator.write_json_document(build_doc_with_sentinels(), out, validate=False)
+
+    assert_json_document_sentinels(out.getvalue())
+
+
 @patch('ws_sbom_generator.sbom_generator.write_file', return_value="FULL_PATH")
 def test_write_report_json(mock_write_file):
     returned = sbom_generator.write_report(document.Document(), "json")